@@ -1,6 +1,5 @@
 """Check that meta-data in ``pyproject.toml`` and ``__init__.py`` are consistent."""
 
-import os.path
 import pathlib
 import sys
 from typing import List
@@ -16,7 +15,7 @@ def main() -> None:
     """Execute the main routine."""
     errors = []  # type: List[str]
 
-    repo_root = pathlib.Path(os.path.realpath(__file__)).parent.parent.parent
+    repo_root = pathlib.Path(__file__).resolve().parents[2]
     pyproject_toml_path = repo_root / "pyproject.toml"
 
     with open(pyproject_toml_path, "rb") as f:
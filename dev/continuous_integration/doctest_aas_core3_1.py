@@ -0,0 +1,74 @@
+"""Run the doctests of all the ``aas_core3_1`` modules in a single process."""
+
+import doctest
+import importlib
+import mmap
+import os
+import pathlib
+import sys
+from typing import Iterator
+
+
+def _iter_py_files(root: str) -> Iterator[str]:
+    """
+    Iterate recursively over the Python files beneath ``root``.
+
+    We use :py:func:`os.scandir` instead of ``pathlib``'s recursive glob
+    since the directory entries carry the file type from the directory read
+    itself, sparing a stat call and a ``Path`` allocation per entry.
+    """
+    with os.scandir(root) as iterator:
+        for entry in iterator:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _iter_py_files(entry.path)
+            elif entry.name.endswith(".py") and entry.name != "__main__.py":
+                yield entry.path
+
+
+def main() -> int:
+    """Execute the main routine."""
+    repo_root = pathlib.Path(__file__).resolve().parents[2]
+
+    # NOTE (mristin):
+    # Make sure that we test the in-tree package even if it has not been
+    # installed into the environment.
+    sys.path.insert(0, str(repo_root))
+
+    failure_count = 0
+
+    for path_str in sorted(_iter_py_files(str(repo_root / "aas_core3_1"))):
+        pth = pathlib.Path(path_str)
+
+        # NOTE (mristin):
+        # Importing and running the doctests is expensive, so we only consider
+        # the modules which contain an actual doctest. Some of the generated
+        # modules are megabytes large, so we search the memory-mapped bytes
+        # instead of decoding the whole file into a string.
+        if pth.stat().st_size == 0:
+            continue
+
+        with pth.open("rb") as fid:
+            with mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                has_doctest = mm.find(b">>>") != -1
+
+        if not has_doctest:
+            continue
+
+        qualified_name = ".".join(pth.relative_to(repo_root).with_suffix("").parts)
+
+        module = importlib.import_module(qualified_name)
+
+        result = doctest.testmod(module, verbose=False)
+        if result.failed > 0:
+            print(
+                f"There were {result.failed} doctest failure(s) "
+                f"in the module {qualified_name}.",
+                file=sys.stderr,
+            )
+            failure_count += result.failed
+
+    return 0 if failure_count == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
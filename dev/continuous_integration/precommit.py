@@ -3,13 +3,20 @@
 """Run pre-commit checks on the repository."""
 
 import argparse
+import concurrent.futures
 import enum
+import hashlib
+import importlib.metadata
+import json
 import os
 import pathlib
+import queue
 import shlex
 import subprocess
 import sys
-from typing import Optional, Mapping, Sequence
+import threading
+import time
+from typing import Callable, List, Optional, Mapping, Sequence, Tuple
 
 
 # pylint: disable=unnecessary-comprehension
@@ -26,6 +33,110 @@ class Step(enum.Enum):
     CHECK_INIT_AND_PYPROJECT_TOML_CONSISTENT = "check-init-and-pyproject-consistent"
 
 
+#: Directory beneath the repository root where we persist the fingerprints of
+#: the successful pre-commit runs
+_CACHE_DIR = ".precommit_cache"
+
+#: Files relevant for the steps which check the whole code base
+_CHECK_GLOBS = [
+    "aas_core3_1/**/*.py",
+    "dev/continuous_integration/**/*.py",
+    "dev/tests/**/*.py",
+    "dev/dev_scripts/**/*.py",
+]
+
+#: Prefix of the relative paths which the checks exclude
+_CHECK_EXCLUDE = "dev/dev_scripts/codegen"
+
+
+def _compute_fingerprint(
+    repo_root: pathlib.Path,
+    globs: Sequence[str],
+    exclude: Optional[str],
+    config_globs: Sequence[str],
+    tools: Sequence[str],
+) -> str:
+    """
+    Fingerprint the inputs of a pre-commit step.
+
+    The fingerprint covers the paths, sizes and modification times of the
+    relevant files, the contents of the configuration files, the versions of
+    the involved tools and the Python version, so a matching fingerprint means
+    that the step would produce the same result as in the previous run.
+    """
+    hasher = hashlib.blake2b()
+
+    hasher.update(sys.version.encode("utf-8"))
+
+    paths = []  # type: List[pathlib.Path]
+    for pattern in globs:
+        paths.extend(repo_root.glob(pattern))
+
+    for pth in sorted(paths):
+        rel = pth.relative_to(repo_root).as_posix()
+        if exclude is not None and rel.startswith(exclude):
+            continue
+
+        stat = pth.stat()
+        hasher.update(rel.encode("utf-8"))
+        hasher.update(f"\x00{stat.st_mtime_ns}\x00{stat.st_size}\x00".encode("ascii"))
+
+    for pattern in config_globs:
+        for pth in sorted(repo_root.glob(pattern)):
+            hasher.update(pth.read_bytes())
+
+    for tool in tools:
+        try:
+            version = importlib.metadata.version(tool)
+        except importlib.metadata.PackageNotFoundError:
+            version = ""
+
+        hasher.update(f"{tool}=={version}\x00".encode("utf-8"))
+
+    return hasher.hexdigest()
+
+
+def _run_with_cache(
+    step: Step,
+    repo_root: pathlib.Path,
+    fingerprint: str,
+    run: Callable[[], int],
+) -> int:
+    """
+    Run the step unless its inputs match those of the last successful run.
+
+    Only successful runs are cached so that failing steps are always
+    re-executed and re-reported with their full output.
+    """
+    cache_path = repo_root / _CACHE_DIR / f"{step.value}.json"
+
+    try:
+        entry = json.loads(cache_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        entry = None
+
+    if entry is not None and entry.get("fingerprint") == fingerprint:
+        print(f"Skipped {step.value}: inputs unchanged since the last successful run.")
+        return 0
+
+    exit_code = run()
+
+    if exit_code == 0:
+        cache_path.parent.mkdir(exist_ok=True)
+        cache_path.write_text(
+            json.dumps(
+                {
+                    "fingerprint": fingerprint,
+                    "exit_code": exit_code,
+                    "timestamp": time.time(),
+                }
+            ),
+            encoding="utf-8",
+        )
+
+    return exit_code
+
+
 def call_and_report(
     verb: str,
     cmd: Sequence[str],
@@ -35,23 +146,355 @@ def call_and_report(
     """
     Wrap a subprocess call with the reporting to STDERR if it failed.
 
+    The output of the command is captured and printed in a single call once
+    the command finished so that concurrently running steps do not interleave
+    their output.
+
     Return 1 if there is an error and 0 otherwise.
     """
     cmd_str = " ".join(shlex.quote(part) for part in cmd)
 
     if cwd is not None:
-        print(f"Executing from {cwd}: {cmd_str}")
+        header = f"Executing from {cwd}: {cmd_str}"
     else:
-        print(f"Executing: {cmd_str}")
+        header = f"Executing: {cmd_str}"
+
+    proc = subprocess.run(
+        cmd,
+        cwd=str(cwd) if cwd is not None else None,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        check=False,
+    )
 
-    exit_code = subprocess.call(cmd, cwd=str(cwd) if cwd is not None else None, env=env)
+    output = proc.stdout.decode("utf-8", errors="replace")
+    if output == "":
+        print(header)
+    else:
+        print(f"{header}\n{output.rstrip()}")
 
-    if exit_code != 0:
+    if proc.returncode != 0:
         print(
-            f"Failed to {verb} with exit code {exit_code}: {cmd_str}", file=sys.stderr
+            f"Failed to {verb} with exit code {proc.returncode}: {cmd_str}",
+            file=sys.stderr,
         )
 
-    return exit_code
+    return proc.returncode
+
+
+def _run_reformat(repo_root: pathlib.Path, overwrite: bool) -> int:
+    """Re-format the code or check the formatting."""
+    reformat_targets = [
+        "aas_core3_1",
+        "dev/continuous_integration",
+        "dev/tests",
+        "dev/dev_scripts",
+    ]
+
+    reformat_exclude = "dev/dev_scripts/codegen"
+
+    if overwrite:
+        print("Re-formatting...")
+        return call_and_report(
+            verb="black",
+            cmd=[sys.executable, "-m", "black"]
+            + reformat_targets
+            + ["--exclude", reformat_exclude],
+            cwd=repo_root,
+        )
+
+    def execute() -> int:
+        print("Re-formatting...")
+        return call_and_report(
+            verb="check with black",
+            cmd=[sys.executable, "-m", "black", "--check"]
+            + reformat_targets
+            + ["--exclude", reformat_exclude],
+            cwd=repo_root,
+        )
+
+    # NOTE (mristin):
+    # We only cache the check mode. With ``--overwrite``, black modifies the
+    # files, so the step must always run.
+    fingerprint = _compute_fingerprint(
+        repo_root=repo_root,
+        globs=_CHECK_GLOBS,
+        exclude=_CHECK_EXCLUDE,
+        config_globs=["pyproject.toml"],
+        tools=["black"],
+    )
+    return _run_with_cache(Step.REFORMAT, repo_root, fingerprint, execute)
+
+
+def _run_mypy(repo_root: pathlib.Path) -> int:
+    """Type-check the code with mypy."""
+    mypy_targets = [
+        "aas_core3_1",
+        "dev/tests",
+        "dev/continuous_integration",
+        "dev/dev_scripts",
+    ]
+
+    mypy_exclude = "dev/dev_scripts/codegen"
+
+    config_file = pathlib.Path("dev/continuous_integration/mypy.ini")
+
+    def execute() -> int:
+        print("Mypy'ing...")
+        return call_and_report(
+            verb="mypy",
+            cmd=[
+                sys.executable,
+                "-m",
+                "mypy",
+                "--strict",
+                "--config-file",
+                str(config_file),
+            ]
+            + mypy_targets
+            + ["--exclude", mypy_exclude],
+            cwd=repo_root,
+        )
+
+    fingerprint = _compute_fingerprint(
+        repo_root=repo_root,
+        globs=_CHECK_GLOBS,
+        exclude=_CHECK_EXCLUDE,
+        config_globs=["dev/continuous_integration/mypy.ini"],
+        tools=["mypy"],
+    )
+    return _run_with_cache(Step.MYPY, repo_root, fingerprint, execute)
+
+
+def _run_pylint(repo_root: pathlib.Path) -> int:
+    """Lint the code with pylint."""
+    pylint_targets = [
+        "aas_core3_1",
+        "dev/tests",
+        "dev/continuous_integration",
+        "dev/dev_scripts",
+    ]
+
+    pylint_ignore = "dev/dev_scripts/codegen"
+
+    rcfile = pathlib.Path("dev/continuous_integration/pylint.rc")
+
+    def execute() -> int:
+        print("Pylint'ing...")
+        return call_and_report(
+            verb="pylint",
+            cmd=[sys.executable, "-m", "pylint", f"--rcfile={rcfile}"]
+            + pylint_targets
+            + [f"--ignore-paths={pylint_ignore}"],
+            cwd=repo_root,
+        )
+
+    fingerprint = _compute_fingerprint(
+        repo_root=repo_root,
+        globs=_CHECK_GLOBS,
+        exclude=_CHECK_EXCLUDE,
+        config_globs=["dev/continuous_integration/pylint.rc"],
+        tools=["pylint"],
+    )
+    return _run_with_cache(Step.PYLINT, repo_root, fingerprint, execute)
+
+
+def _run_in_parallel(procs: Sequence["subprocess.Popen[bytes]"]) -> bool:
+    """
+    Wait for all the processes to finish.
+
+    If any of the processes failed, terminate all the remaining ones.
+
+    Return True if there was a failure.
+    """
+    # NOTE (mristin):
+    # We used to poll every process once a second, which added up to a second
+    # of latency at the tail of every batch and woke the interpreter without
+    # need. Instead, a waiter thread blocks on each child and reports its
+    # completion through a queue, so we react to an exit within microseconds.
+    # Reaping with ``os.waitpid(-1, 0)`` would be even cheaper, but it would
+    # steal the exit status from ``Popen`` and corrupt ``returncode``.
+    completions = queue.Queue()  # type: queue.Queue[subprocess.Popen[bytes]]
+
+    def wait_on(proc: "subprocess.Popen[bytes]") -> None:
+        proc.wait()
+        completions.put(proc)
+
+    threads = [
+        threading.Thread(target=wait_on, args=(proc,), daemon=True) for proc in procs
+    ]
+    for thread in threads:
+        thread.start()
+
+    failure = False
+    remaining_procs = len(procs)
+    next_status_update = time.time() + 15.0
+
+    while remaining_procs > 0:
+        try:
+            proc = completions.get(timeout=max(0.0, next_status_update - time.time()))
+        except queue.Empty:
+            print(f"There are still {remaining_procs} process(es) running...")
+            next_status_update = time.time() + 15.0
+            continue
+
+        remaining_procs -= 1
+
+        if proc.returncode != 0:
+            failure = True
+            break
+
+    if failure:
+        # NOTE (mristin):
+        # No ``poll`` guard is needed here since ``terminate`` itself checks
+        # whether the child already exited before sending the signal.
+        for proc in procs:
+            proc.terminate()
+
+    for proc in procs:
+        proc.wait()
+
+    for thread in threads:
+        thread.join()
+
+    return failure
+
+
+def _run_test(repo_root: pathlib.Path) -> int:
+    """Run the unit tests sharded over the processors and report the coverage."""
+    print("Testing...")
+    env = os.environ.copy()
+    env["ICONTRACT_SLOW"] = "true"
+
+    # NOTE (mristin):
+    # The ``tests`` package lives beneath ``dev/``. The previous
+    # ``unittest discover --start-directory dev/tests`` put it on ``sys.path``
+    # implicitly; the sharded invocations below do not, so we have to extend
+    # the ``PYTHONPATH`` of the workers ourselves.
+    dev_dir = str(repo_root / "dev")
+    if env.get("PYTHONPATH"):
+        env["PYTHONPATH"] = dev_dir + os.pathsep + env["PYTHONPATH"]
+    else:
+        env["PYTHONPATH"] = dev_dir
+
+    # NOTE (mristin):
+    # The test modules are independent of each other, so we shard them over
+    # the processors instead of running them in a single process. Every worker
+    # writes its own coverage data file (``--parallel-mode``) which
+    # ``coverage combine`` merges afterwards.
+    test_names = sorted(
+        f"tests.{pth.stem}" for pth in (repo_root / "dev" / "tests").glob("test_*.py")
+    )
+    if len(test_names) == 0:
+        print("No test modules found.", file=sys.stderr)
+        return 1
+
+    worker_count = min(len(test_names), os.cpu_count() or 1)
+    shards = [test_names[i::worker_count] for i in range(worker_count)]
+
+    print(
+        f"Running {len(test_names)} test module(s) "
+        f"in {worker_count} parallel shard(s)..."
+    )
+
+    procs = []  # type: List[subprocess.Popen[bytes]]
+    for shard in shards:
+        # NOTE (mristin):
+        # The life cycle of the children is managed manually through
+        # ``_run_in_parallel``, so a ``with`` block does not apply here.
+        procs.append(
+            subprocess.Popen(  # pylint: disable=consider-using-with
+                [
+                    sys.executable,
+                    "-m",
+                    "coverage",
+                    "run",
+                    "--parallel-mode",
+                    "--source",
+                    "aas_core3_1",
+                    "-m",
+                    "unittest",
+                ]
+                + shard,
+                cwd=str(repo_root),
+                env=env,
+            )
+        )
+
+    failure = _run_in_parallel(procs)
+    if failure:
+        print("One or more of the test shards failed.", file=sys.stderr)
+        return 1
+
+    exit_code = call_and_report(
+        verb="combine the coverage data",
+        cmd=[sys.executable, "-m", "coverage", "combine"],
+        cwd=repo_root,
+    )
+    if exit_code != 0:
+        return exit_code
+
+    return call_and_report(
+        verb="report the coverage",
+        cmd=[sys.executable, "-m", "coverage", "report"],
+        cwd=repo_root,
+    )
+
+
+def _run_doctest(repo_root: pathlib.Path) -> int:
+    """Run the doctests in the documentation and in the code."""
+
+    def execute() -> int:
+        print("Doctest'ing...")
+
+        doc_files = sorted(
+            ["README.rst"]
+            + [str(path) for path in (repo_root / "docs" / "source").glob("**/*.rst")]
+        )
+
+        exit_code = call_and_report(
+            verb="doctest",
+            cmd=[sys.executable, "-m", "doctest"] + doc_files,
+            cwd=repo_root,
+        )
+        if exit_code != 0:
+            return exit_code
+
+        # NOTE (mristin):
+        # The subprocess calls are expensive, so all the doctests in the
+        # modules run in-process in a single helper script instead of
+        # one ``python -m doctest`` call per module.
+        return call_and_report(
+            verb="doctest",
+            cmd=[
+                sys.executable,
+                "dev/continuous_integration/doctest_aas_core3_1.py",
+            ],
+            cwd=repo_root,
+        )
+
+    fingerprint = _compute_fingerprint(
+        repo_root=repo_root,
+        globs=["aas_core3_1/**/*.py", "README.rst", "docs/source/**/*.rst"],
+        exclude=None,
+        config_globs=[],
+        tools=[],
+    )
+    return _run_with_cache(Step.DOCTEST, repo_root, fingerprint, execute)
+
+
+def _run_check_init_and_pyproject_toml_consistent(repo_root: pathlib.Path) -> int:
+    """Check that ``__init__.py`` and ``pyproject.toml`` are consistent."""
+    print("Checking that __init__.py and pyproject.toml are consistent...")
+    return call_and_report(
+        verb="check that __init__.py and pyproject.toml are consistent",
+        cmd=[
+            sys.executable,
+            "dev/continuous_integration/check_init_and_pyproject_toml_consistent.py",
+        ],
+        cwd=repo_root,
+    )
 
 
 def main() -> int:
@@ -100,167 +543,37 @@ def main() -> int:
     )
     skips = [Step(value) for value in args.skip] if args.skip is not None else []
 
-    repo_root = pathlib.Path(os.path.realpath(__file__)).parent.parent.parent
+    repo_root = pathlib.Path(__file__).resolve().parents[2]
 
+    # NOTE (mristin):
+    # The re-formatting must run before all the other steps since it
+    # potentially modifies the files which the other steps then check.
     if Step.REFORMAT in selects and Step.REFORMAT not in skips:
-        print("Re-formatting...")
-        reformat_targets = [
-            "aas_core3_1",
-            "dev/continuous_integration",
-            "dev/tests",
-            "dev/dev_scripts",
-        ]
-
-        reformat_exclude = "dev/dev_scripts/codegen"
-
-        if overwrite:
-            exit_code = call_and_report(
-                verb="black",
-                cmd=[sys.executable, "-m", "black"]
-                + reformat_targets
-                + ["--exclude", reformat_exclude],
-                cwd=repo_root,
-            )
-            if exit_code != 0:
-                return 1
-        else:
-            exit_code = call_and_report(
-                verb="check with black",
-                cmd=[sys.executable, "-m", "black", "--check"]
-                + reformat_targets
-                + ["--exclude", reformat_exclude],
-                cwd=repo_root,
-            )
-            if exit_code != 0:
-                return 1
+        if _run_reformat(repo_root=repo_root, overwrite=overwrite) != 0:
+            return 1
     else:
         print("Skipped re-formatting.")
 
-    if Step.MYPY in selects and Step.MYPY not in skips:
-        print("Mypy'ing...")
-        mypy_targets = [
-            "aas_core3_1",
-            "dev/tests",
-            "dev/continuous_integration",
-            "dev/dev_scripts",
-        ]
-
-        mypy_exclude = "dev/dev_scripts/codegen"
+    # NOTE (mristin):
+    # Mypy, pylint, doctest and the consistency check neither modify the
+    # repository nor depend on each other, so we run them concurrently. The
+    # tests are deliberately kept out of the batch since they write the
+    # coverage data and are usually the longest step, so they run alone
+    # afterwards.
+    concurrent_runs = []  # type: List[Tuple[Step, Callable[[], int]]]
 
-        config_file = pathlib.Path("dev/continuous_integration/mypy.ini")
-
-        exit_code = call_and_report(
-            verb="mypy",
-            cmd=[
-                sys.executable,
-                "-m",
-                "mypy",
-                "--strict",
-                "--config-file",
-                str(config_file),
-            ]
-            + mypy_targets
-            + ["--exclude", mypy_exclude],
-            cwd=repo_root,
-        )
-        if exit_code != 0:
-            return 1
+    if Step.MYPY in selects and Step.MYPY not in skips:
+        concurrent_runs.append((Step.MYPY, lambda: _run_mypy(repo_root)))
     else:
         print("Skipped mypy'ing.")
 
     if Step.PYLINT in selects and Step.PYLINT not in skips:
-        print("Pylint'ing...")
-        pylint_targets = [
-            "aas_core3_1",
-            "dev/tests",
-            "dev/continuous_integration",
-            "dev/dev_scripts",
-        ]
-
-        pylint_ignore = "dev/dev_scripts/codegen"
-
-        rcfile = pathlib.Path("dev/continuous_integration/pylint.rc")
-
-        exit_code = call_and_report(
-            verb="pylint",
-            cmd=[sys.executable, "-m", "pylint", f"--rcfile={rcfile}"]
-            + pylint_targets
-            + [f"--ignore-paths={pylint_ignore}"],
-            cwd=repo_root,
-        )
-        if exit_code != 0:
-            return 1
+        concurrent_runs.append((Step.PYLINT, lambda: _run_pylint(repo_root)))
     else:
         print("Skipped pylint'ing.")
 
-    if Step.TEST in selects and Step.TEST not in skips:
-        print("Testing...")
-        env = os.environ.copy()
-        env["ICONTRACT_SLOW"] = "true"
-
-        exit_code = call_and_report(
-            verb="execute unit tests",
-            cmd=[
-                sys.executable,
-                "-m",
-                "coverage",
-                "run",
-                "--source",
-                "aas_core3_1",
-                "-m",
-                "unittest",
-                "discover",
-                "--start-directory",
-                "dev/tests",
-            ],
-            cwd=repo_root,
-            env=env,
-        )
-        if exit_code != 0:
-            return 1
-
-        exit_code = call_and_report(
-            verb="report the coverage",
-            cmd=[sys.executable, "-m", "coverage", "report"],
-            cwd=repo_root,
-        )
-        if exit_code != 0:
-            return 1
-    else:
-        print("Skipped testing.")
-
     if Step.DOCTEST in selects and Step.DOCTEST not in skips:
-        print("Doctest'ing...")
-
-        doc_files = sorted(
-            ["README.rst"]
-            + [str(path) for path in (repo_root / "docs" / "source").glob("**/*.rst")]
-        )
-
-        exit_code = call_and_report(
-            verb="doctest",
-            cmd=[sys.executable, "-m", "doctest"] + doc_files,
-            cwd=repo_root,
-        )
-        if exit_code != 0:
-            return 1
-
-        for pth in (repo_root / "aas_core3_1").glob("**/*.py"):
-            if pth.name == "__main__.py":
-                continue
-
-            # NOTE (mristin):
-            # The subprocess calls are expensive, call only if there is an actual
-            # doctest
-            text = pth.read_text(encoding="utf-8")
-            if ">>>" in text:
-                exit_code = call_and_report(
-                    verb="doctest",
-                    cmd=[sys.executable, "-m", "doctest", str(pth)],
-                    cwd=repo_root,
-                )
-                if exit_code != 0:
-                    return 1
+        concurrent_runs.append((Step.DOCTEST, lambda: _run_doctest(repo_root)))
     else:
         print("Skipped doctest'ing.")
 
@@ -268,20 +581,35 @@ def main() -> int:
         Step.CHECK_INIT_AND_PYPROJECT_TOML_CONSISTENT in selects
         and Step.CHECK_INIT_AND_PYPROJECT_TOML_CONSISTENT not in skips
     ):
-        print("Checking that __init__.py and pyproject.toml are consistent...")
-        exit_code = call_and_report(
-            verb="check that __init__.py and pyproject.toml are consistent",
-            cmd=[
-                sys.executable,
-                "dev/continuous_integration/check_init_and_pyproject_toml_consistent.py",
-            ],
-            cwd=repo_root,
+        concurrent_runs.append(
+            (
+                Step.CHECK_INIT_AND_PYPROJECT_TOML_CONSISTENT,
+                lambda: _run_check_init_and_pyproject_toml_consistent(repo_root),
+            )
         )
-        if exit_code != 0:
-            return 1
     else:
         print("Skipped checking that __init__.py and pyproject.toml are consistent.")
 
+    if len(concurrent_runs) > 0:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(len(concurrent_runs), os.cpu_count() or 1)
+        ) as executor:
+            futures = [executor.submit(func) for _, func in concurrent_runs]
+
+            failure = False
+            for future in concurrent.futures.as_completed(futures):
+                if future.result() != 0:
+                    failure = True
+
+        if failure:
+            return 1
+
+    if Step.TEST in selects and Step.TEST not in skips:
+        if _run_test(repo_root) != 0:
+            return 1
+    else:
+        print("Skipped testing.")
+
     return 0
 
 
@@ -0,0 +1,7 @@
+"""Provide the repository paths computed once at import time."""
+
+import pathlib
+from typing import Final
+
+#: Root directory of the repository
+REPO_ROOT: Final[pathlib.Path] = pathlib.Path(__file__).resolve().parents[2]
@@ -1,13 +1,13 @@
 """Download the meta-model to this directory."""
 
-import pathlib
-import os
 import argparse
 import sys
 from typing import Dict, Union
 
 import requests
 
+from _paths import REPO_ROOT
+
 
 GITHUB_API = "https://api.github.com"
 OWNER = "aas-core-works"
@@ -69,8 +69,6 @@ def main() -> int:
     parser = argparse.ArgumentParser(description=__doc__)
     _ = parser.parse_args()
 
-    repo_root = pathlib.Path(os.path.realpath(__file__)).parent.parent.parent
-
     sha = _latest_commit_sha_for_path(OWNER, REPO, REF, FILEPATH)
 
     content = _download_raw_from_commit(OWNER, REPO, sha, FILEPATH)
@@ -78,7 +76,7 @@ def main() -> int:
     pinned_url = f"https://raw.githubusercontent.com/{OWNER}/{REPO}/{sha}/{FILEPATH}"
     banner = f"# Downloaded from: {pinned_url}\n"
 
-    out_path = repo_root / "dev" / "dev_scripts" / "codegen" / "meta_model.py"
+    out_path = REPO_ROOT / "dev" / "dev_scripts" / "codegen" / "meta_model.py"
 
     out_path.write_text(f"{banner}{content.rstrip()}\n\n{banner}", encoding="utf-8")
 
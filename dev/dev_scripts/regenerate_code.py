@@ -3,24 +3,25 @@
 import argparse
 import os
 import pathlib
-import subprocess
 import sys
 
+import aas_core_codegen.main
+
+from _paths import REPO_ROOT
+
 
 def main() -> int:
     """Execute the main routine."""
-    repo_root = pathlib.Path(os.path.realpath(__file__)).parent.parent.parent
-
     default_meta_model_path = os.path.relpath(
-        str(repo_root / "dev" / "dev_scripts" / "codegen" / "meta_model.py"),
+        str(REPO_ROOT / "dev" / "dev_scripts" / "codegen" / "meta_model.py"),
         os.getcwd(),
     )
 
     default_snippet_dir = os.path.relpath(
-        str(repo_root / "dev" / "dev_scripts" / "codegen" / "snippets"), os.getcwd()
+        str(REPO_ROOT / "dev" / "dev_scripts" / "codegen" / "snippets"), os.getcwd()
     )
 
-    default_output_dir = os.path.relpath(str(repo_root), os.getcwd())
+    default_output_dir = os.path.relpath(str(REPO_ROOT), os.getcwd())
 
     parser = argparse.ArgumentParser(
         description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
@@ -44,23 +45,21 @@ def main() -> int:
     snippet_dir = pathlib.Path(args.snippet_dir)
     output_dir = pathlib.Path(args.output_dir)
 
-    subprocess.run(
-        [
-            "aas-core-codegen",
-            "--model_path",
-            str(meta_model_path),
-            "--snippets_dir",
-            str(snippet_dir),
-            "--output_dir",
-            str(output_dir),
-            "--target",
-            "python",
-        ],
-        check=True,
+    # NOTE (mristin):
+    # We run the generator in-process instead of spawning an
+    # ``aas-core-codegen`` subprocess so that repeated runs do not pay the
+    # interpreter start-up and the import of the whole codegen package.
+    return aas_core_codegen.main.execute(
+        params=aas_core_codegen.main.Parameters(
+            model_path=meta_model_path,
+            target=aas_core_codegen.main.Target.PYTHON,
+            snippets_dir=snippet_dir,
+            output_dir=output_dir,
+        ),
+        stdout=sys.stdout,
+        stderr=sys.stderr,
     )
 
-    return 0
-
 
 if __name__ == "__main__":
     sys.exit(main())
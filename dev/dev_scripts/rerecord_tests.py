@@ -1,46 +1,252 @@
 """Run all tests and re-record the golden data."""
 
 import argparse
+import collections
+import contextlib
 import os
-import pathlib
+import queue
+import shlex
 import shutil
 import subprocess
 import sys
+import threading
+import time
+from typing import Dict, List, Mapping, Sequence, Tuple
+
+from _paths import REPO_ROOT
+
+
+def _run_bounded(
+    commands: Sequence[Sequence[str]],
+    env: Mapping[str, str],
+    max_inflight: int,
+) -> bool:
+    """
+    Run the commands concurrently, but at most ``max_inflight`` at a time.
+
+    Return True if any of the commands failed.
+    """
+    assert max_inflight >= 1, f"{max_inflight=}"
+
+    pending = collections.deque(commands)
+
+    # NOTE (mristin):
+    # We copy the environment once here instead of once per spawn; the
+    # children must not mutate it anyhow, and ``Popen`` serializes the very
+    # same mapping into the ``execve`` environment for every child.
+    env_copy = dict(env)
+
+    # NOTE (mristin):
+    # We capture the output of every command and print it in one go once the
+    # command finished, so that the concurrent runs do not interleave their
+    # output and a failing run can be reported with its log. A reader thread
+    # per child drains its pipe and reports the completion through a queue,
+    # following the pattern of ``_run_in_parallel`` in the pre-commit script.
+    # Unlike a selector on the pipes, this also works on Windows, where the
+    # default selector only supports sockets.
+    completions = queue.Queue()  # type: queue.Queue[subprocess.Popen[bytes]]
+    running = {}  # type: Dict[subprocess.Popen[bytes], Tuple[str, bytearray]]
+    threads = []  # type: List[threading.Thread]
+
+    def drain_and_wait(proc: "subprocess.Popen[bytes]") -> None:
+        """Read the output of the child until its exit and report it."""
+        _, buffer = running[proc]
+        assert proc.stdout is not None
+
+        while True:
+            chunk = proc.stdout.read(65536)
+            if len(chunk) == 0:
+                break
+            buffer.extend(chunk)
+
+        proc.wait()
+        completions.put(proc)
+
+    failure = False
+    next_status_update = time.time() + 15.0
+
+    def terminate_remaining() -> None:
+        """Terminate, reap and clean up the children which still run."""
+        for proc in running:
+            proc.terminate()
+
+        for proc in running:
+            proc.wait()
+            assert proc.stdout is not None
+            proc.stdout.close()
+
+    # NOTE (mristin):
+    # The exit stack makes sure that the children are terminated and the
+    # pipes are closed even if the loop below raises, e.g., on a keyboard
+    # interrupt; otherwise the children would outlive the runner.
+    with contextlib.ExitStack() as stack:
+        stack.callback(terminate_remaining)
+
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < max_inflight and not failure:
+                cmd = list(pending.popleft())
+                # NOTE (mristin):
+                # The life cycle of the child is managed through the exit
+                # stack, so a ``with`` block does not apply here.
+                proc = subprocess.Popen(  # pylint: disable=consider-using-with
+                    cmd,
+                    cwd=str(REPO_ROOT),
+                    env=env_copy,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                )
+                running[proc] = (
+                    " ".join(shlex.quote(part) for part in cmd),
+                    bytearray(),
+                )
+
+                thread = threading.Thread(
+                    target=drain_and_wait, args=(proc,), daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+            if len(running) == 0:
+                break
+
+            try:
+                proc = completions.get(
+                    timeout=max(0.0, next_status_update - time.time())
+                )
+            except queue.Empty:
+                print(
+                    f"There are still {len(running)} process(es) running "
+                    f"and {len(pending)} pending..."
+                )
+                next_status_update = time.time() + 15.0
+                continue
+
+            cmd_str, buffer = running.pop(proc)
+            assert proc.stdout is not None
+            proc.stdout.close()
+
+            output = buffer.decode("utf-8", errors="replace").rstrip()
+            if output == "":
+                print(f"Finished: {cmd_str}")
+            else:
+                print(f"Finished: {cmd_str}\n{output}")
+
+            if proc.returncode != 0:
+                print(
+                    f"Failed with exit code {proc.returncode}: {cmd_str}",
+                    file=sys.stderr,
+                )
+                failure = True
+                break
+
+    for thread in threads:
+        thread.join()
+
+    return failure
+
+
+def _find_test_modules() -> List[str]:
+    """
+    Collect the sorted qualified names of the test modules.
+
+    We list the directory with :py:func:`os.scandir` instead of ``pathlib``'s
+    glob since the directory entries carry the file type from the directory
+    read itself, sparing a stat call and a ``Path`` allocation per entry.
+    """
+    with os.scandir(str(REPO_ROOT / "dev" / "tests")) as iterator:
+        return sorted(
+            f"tests.{entry.name[: -len('.py')]}"
+            for entry in iterator
+            if entry.is_file()
+            and entry.name.startswith("test_")
+            and entry.name.endswith(".py")
+        )
 
 
 def main() -> int:
     """Execute the main routine."""
     parser = argparse.ArgumentParser(description=__doc__)
-    _ = parser.parse_args()
+    parser.add_argument(
+        "--max_parallel",
+        help="Maximum number of test processes to run at the same time",
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+    args = parser.parse_args()
 
-    repo_root = pathlib.Path(os.path.realpath(__file__)).parent.parent.parent
+    max_parallel = int(args.max_parallel)
+    if max_parallel < 1:
+        parser.error(
+            f"--max_parallel must be a positive integer, but got: {max_parallel}"
+        )
 
     env = os.environ.copy()
     env["AAS_CORE3_1_TESTS_RECORD_MODE"] = "1"
 
-    for path in (repo_root / "dev/test_data").iterdir():
+    # NOTE (mristin):
+    # The ``tests`` package lives beneath ``dev/``, so the workers need it on
+    # their ``PYTHONPATH``; running from the repository root alone does not
+    # make it importable.
+    dev_dir = str(REPO_ROOT / "dev")
+    if env.get("PYTHONPATH"):
+        env["PYTHONPATH"] = dev_dir + os.pathsep + env["PYTHONPATH"]
+    else:
+        env["PYTHONPATH"] = dev_dir
+
+    for path in (REPO_ROOT / "dev/test_data").iterdir():
         if path.is_dir() and path.name not in ["Json", "Xml"]:
             print(f"Deleting {path} ...")
             shutil.rmtree(path)
 
-    print("Running and re-recording all tests...")
-    subprocess.check_call(
+    # NOTE (mristin):
+    # The test modules re-record disjoint golden files, so they can run in
+    # separate processes. We bound the concurrency by the processor count so
+    # that the runner stays CPU-bound instead of thrashing between many more
+    # processes than there are cores.
+    test_names = _find_test_modules()
+    if len(test_names) == 0:
+        print("No test modules found.", file=sys.stderr)
+        return 1
+
+    # NOTE (mristin):
+    # Every process pays the interpreter start-up and the import of
+    # ``aas_core3_1`` and the test fixtures, which dwarfs many of the test
+    # modules themselves. We therefore batch the modules into one shard per
+    # worker so that these costs are paid once per worker instead of once per
+    # module.
+    worker_count = min(len(test_names), max_parallel)
+    shards = [test_names[i::worker_count] for i in range(worker_count)]
+
+    commands = [
         [
             sys.executable,
             "-m",
             "coverage",
             "run",
+            "--parallel-mode",
             "--source",
             "aas_core3_1",
             "-m",
             "unittest",
-            "discover",
-            "--start-directory",
-            "dev/tests",
-        ],
-        cwd=repo_root,
-        env=env,
+        ]
+        + shard
+        for shard in shards
+    ]
+
+    print(
+        f"Running and re-recording {len(test_names)} test module(s) "
+        f"in {worker_count} parallel shard(s)..."
     )
+    failure = _run_bounded(commands=commands, env=env, max_inflight=max_parallel)
+    if failure:
+        print("One or more of the test runs failed.", file=sys.stderr)
+        return 1
+
+    subprocess.check_call(
+        [sys.executable, "-m", "coverage", "combine"],
+        cwd=str(REPO_ROOT),
+    )
+
     print("Re-recorded.")
 
     return 0
@@ -1,65 +1,191 @@
 """Update to the latest meta-model and the latest test data."""
 
 import argparse
-import os
+import hashlib
+import json
 import pathlib
 import subprocess
 import sys
+from typing import Final, Optional
+
+from _paths import REPO_ROOT
+
+#: Directory where we record the inputs of the previous successful update
+_CACHE_DIR: Final[pathlib.Path] = pathlib.Path.home() / ".cache" / "aas-core3-1"
+
+
+def _read_text_if_exists(path: pathlib.Path) -> Optional[str]:
+    """Read the text content of the file, or return None if it can not be read."""
+    try:
+        return path.read_text(encoding="utf-8")
+    except OSError:
+        return None
+
+
+def _test_data_version() -> Optional[str]:
+    """Read the test-data release version recorded in ``source.json``."""
+    text = _read_text_if_exists(REPO_ROOT / "dev" / "test_data" / "source.json")
+    if text is None:
+        return None
+
+    try:
+        source = json.loads(text)
+    except ValueError:
+        return None
+
+    version = source.get("version") if isinstance(source, dict) else None
+    return version if isinstance(version, str) else None
 
 
 def main() -> int:
     """Execute the main routine."""
     parser = argparse.ArgumentParser(description=__doc__)
-    _ = parser.parse_args()
+    parser.add_argument(
+        "--force",
+        help="Run all the steps even if the upstream inputs have not changed.",
+        action="store_true",
+    )
+    args = parser.parse_args()
 
-    repo_root = pathlib.Path(os.path.realpath(__file__)).parent.parent.parent
+    force = bool(args.force)
 
-    print("Downloading the latest meta-model...")
-    subprocess.check_call(
-        [
-            sys.executable,
-            str(repo_root / "dev" / "dev_scripts" / "download_aas_core_meta_model.py"),
-        ],
-        cwd=str(repo_root),
-    )
+    print("Downloading the latest meta-model and the latest test data...")
 
-    print("Generating the code...")
-    subprocess.check_call(
-        [
-            sys.executable,
-            str(repo_root / "dev" / "dev_scripts" / "regenerate_code.py"),
-        ],
-        cwd=str(repo_root),
+    # NOTE (mristin):
+    # The two downloads hit different endpoints and do not depend on each
+    # other, so they run concurrently. The code generation below needs only
+    # the meta-model, while the test re-recording needs both the generated
+    # code and the test data, so we wait for both downloads here.
+    # NOTE (mristin):
+    # A forced run must also bypass the version short-circuit of the
+    # test-data download, e.g., to recover from locally corrupted test data.
+    download_cmds = [
+        [sys.executable, str(REPO_ROOT / "dev" / "dev_scripts" / script)]
+        for script in (
+            "download_aas_core_meta_model.py",
+            "download_latest_test_data.py",
+        )
+    ]
+    if force:
+        download_cmds[1].append("--force")
+
+    download_procs = [
+        # NOTE (mristin):
+        # The life cycle of the children is managed manually below, so a
+        # ``with`` block does not apply here.
+        subprocess.Popen(  # pylint: disable=consider-using-with
+            cmd,
+            cwd=str(REPO_ROOT),
+        )
+        for cmd in download_cmds
+    ]
+
+    try:
+        for proc in download_procs:
+            exit_code = proc.wait()
+            if exit_code != 0:
+                raise subprocess.CalledProcessError(exit_code, proc.args)
+    except BaseException:
+        # NOTE (mristin):
+        # Do not leave the sibling download running past the raised error.
+        for proc in download_procs:
+            proc.terminate()
+
+        for proc in download_procs:
+            proc.wait()
+
+        raise
+
+    # NOTE (mristin):
+    # We fingerprint the freshly downloaded meta-model and compare it with the
+    # fingerprint recorded after the previous successful update, so that the
+    # expensive code generation and re-formatting are skipped when nothing
+    # changed upstream.
+    meta_model_path = REPO_ROOT / "dev" / "dev_scripts" / "codegen" / "meta_model.py"
+    meta_model_sha = hashlib.blake2b(meta_model_path.read_bytes()).hexdigest()
+    meta_model_sha_path = _CACHE_DIR / "meta_model.sha"
+
+    previous_sha_text = _read_text_if_exists(meta_model_sha_path)
+    meta_model_unchanged = (
+        previous_sha_text is not None and previous_sha_text.strip() == meta_model_sha
     )
 
-    print("Re-formatting the code...")
-    subprocess.check_call(
-        [sys.executable, "-m", "black", "aas_core3_1", "dev/tests"], cwd=str(repo_root)
+    reformatted = False
+
+    if meta_model_unchanged and not force:
+        print("The meta-model has not changed; skipping the code generation.")
+    else:
+        print("Generating the code...")
+        subprocess.check_call(
+            [
+                sys.executable,
+                str(REPO_ROOT / "dev" / "dev_scripts" / "regenerate_code.py"),
+            ],
+            cwd=str(REPO_ROOT),
+        )
+
+        # NOTE (mristin):
+        # The re-formatting must finish before the re-recording starts. Black
+        # rewrites the files in place and not atomically, and the re-recording
+        # workers import the very same modules; a worker importing a file
+        # truncated at a statement boundary could silently run an incomplete
+        # test module and record incomplete golden data.
+        print("Re-formatting the code...")
+        subprocess.check_call(
+            [sys.executable, "-m", "black", "aas_core3_1", "dev/tests"],
+            cwd=str(REPO_ROOT),
+        )
+        reformatted = True
+
+    test_data_version = _test_data_version()
+    test_data_version_path = _CACHE_DIR / "test_data.version"
+    test_data_unchanged = (
+        test_data_version is not None
+        and _read_text_if_exists(test_data_version_path) == test_data_version
     )
 
-    print("Downloading the latest test data...")
+    # NOTE (mristin):
+    # The recorded golden data depends both on the test data and on the
+    # generated code, so the re-recording is only skipped if neither changed.
+    if meta_model_unchanged and test_data_unchanged and not force:
+        # NOTE (mristin):
+        # The pre-commit below only re-checks the outputs of the re-recording
+        # and the code generation, so there is nothing left to check either
+        # on a completely unchanged run.
+        print(
+            "Neither the meta-model nor the test data changed; "
+            "everything is already up to date."
+        )
+        return 0
+
+    print("Re-recording the test data...")
     subprocess.check_call(
         [
             sys.executable,
-            str(repo_root / "dev" / "dev_scripts" / "download_latest_test_data.py"),
+            str(REPO_ROOT / "dev" / "dev_scripts" / "rerecord_tests.py"),
         ],
-        cwd=str(repo_root),
+        cwd=str(REPO_ROOT),
     )
 
-    print("Re-recording the test data...")
-    subprocess.check_call(
-        [sys.executable, str(repo_root / "dev" / "dev_scripts" / "rerecord_tests.py")],
-        cwd=str(repo_root),
-    )
+    if test_data_version is not None:
+        _CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        test_data_version_path.write_text(test_data_version, encoding="utf-8")
+
+    if reformatted:
+        # NOTE (mristin):
+        # We record the fingerprint only after both the re-formatting and the
+        # re-recording succeeded, so that a failed update is fully re-run.
+        _CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        meta_model_sha_path.write_text(meta_model_sha, encoding="utf-8")
 
     print("Running the pre-commit to check that everything worked...")
     subprocess.check_call(
         [
             sys.executable,
-            str(repo_root / "dev" / "continuous_integration" / "precommit.py"),
+            str(REPO_ROOT / "dev" / "continuous_integration" / "precommit.py"),
             "--overwrite",
         ],
-        cwd=str(repo_root),
+        cwd=str(REPO_ROOT),
     )
 
     return 0
@@ -0,0 +1,9 @@
+"""
+Test the SDK against the recorded golden data.
+
+Some of the generated test modules reference ``tests.common`` without
+importing it themselves, counting on a sibling test module to import it first
+within the same process. We import it here so that every test module can also
+run in a process of its own.
+"""
+import tests.common  # pylint: disable=unused-import